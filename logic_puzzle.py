@@ -1,11 +1,23 @@
+import bisect
 import itertools
 import logging
-import networkx as nx
 import pprint
+import types
 
 logger = logging.getLogger(__name__)
 
+def _bits(mask):
+    # Yields the index of every set bit in 'mask', lowest first
+    while mask:
+        lsb = mask & -mask
+        yield lsb.bit_length() - 1
+        mask ^= lsb
+
 class Comparison:
+    # A plain comparison only says greater is more than lesser. DeltaComparison sets a fixed
+    # difference, and both share __call__ below.
+    _delta = 0
+
     def __init__(self, greater, lesser):
         self._greater = greater
         self._lesser = lesser
@@ -18,86 +30,47 @@ class Comparison:
     def lesser(self):
         return self._lesser
 
+    @property
+    def delta(self):
+        return self._delta
+
     def __call__(self, puzzle):
         # If we're comparing the two values, they can't be the same item
         puzzle.mark_false(self._lesser, self._greater)
-        # Get the values of the ordinal category
-        ordinals = puzzle._items[puzzle.ordinal_category]
         # At the very least lesser can't be the max ordinal, greater can't be the min ordinal
-        puzzle.mark_false(self._greater, min(ordinals))
-        puzzle.mark_false(self._lesser, max(ordinals))
+        puzzle.mark_false(self._greater, puzzle._ord_min)
+        puzzle.mark_false(self._lesser, puzzle._ord_max)
         
         # Up until now, we haven't compared lesser or greater.
-        # lambda to figure out what ordinals are neighbors of lesser and greater
-        ord_neighbors = lambda x: puzzle.neighbors(x, puzzle.ordinal_category)
+        # Figure out the smallest ordinal lesser can be and the largest ordinal greater can be
+        lesser_min = min(puzzle.neighbors(self._lesser, puzzle.ordinal_category))
+        greater_max = max(puzzle.neighbors(self._greater, puzzle.ordinal_category))
         
-        for o in ordinals:
-            # First, if 'o' is less than or equal to min(lesser), remove it from greater:
-            if o <= min(ord_neighbors(self._lesser)):
-                puzzle.mark_false(self._greater, o)
-
-            # Second, if 'o' is greater than or equal to max(greater), remove it from lesser:
-            if o >= max(ord_neighbors(self._greater)):
-                puzzle.mark_false(self._lesser, o)
+        # The ordinals are sorted, so both ranges below are slices
+        ordinals = puzzle._ord_sorted
+        # First, every 'o' less than or equal to min(lesser) is removed from greater:
+        puzzle.mark_false_many(self._greater, ordinals[:bisect.bisect_right(ordinals, lesser_min)])
+        # Second, every 'o' greater than or equal to max(greater) is removed from lesser:
+        puzzle.mark_false_many(self._lesser, ordinals[bisect.bisect_left(ordinals, greater_max):])
+
+        if self._delta:
+            category = puzzle.ordinal_category
+            not_lesser, not_greater = _delta_prune(ordinals, puzzle._items_set[category],
+                                                   set(puzzle.neighbors(self._lesser, category)),
+                                                   set(puzzle.neighbors(self._greater, category)),
+                                                   self._delta)
+            puzzle.mark_false_many(self._greater, not_greater)
+            puzzle.mark_false_many(self._lesser, not_lesser)
 
 class DeltaComparison(Comparison):
+    # greater is exactly 'delta' more than lesser on the ordinal category
     def __init__(self, greater, lesser, delta):
+        # A zero delta would just be a plain Comparison
         assert delta > 0
-        super().__init__(self, greater=greater, lesser=lesser)
+        super().__init__(greater, lesser)
 
         self._delta = delta
 
-    @property
-    def delta(self):
-        return self._delta
-
-    def __call__(self, puzzle):
-        logger.info(f"\n\nSIZE_DELTA({self.lesser=}, {self.greater=}, {self.delta=})")
-        # If we're comparing the two values, they can't be the same item
-        puzzle.mark_false(self._lesser, self._greater)
-        # Get the values of the ordinal category
-        ordinals = puzzle._items[puzzle.ordinal_category]
-        # At the very least lesser can't be the max ordinal, greater can't be the min ordinal
-        puzzle.mark_false(self._greater, min(ordinals))
-        puzzle.mark_false(self._lesser, max(ordinals))
-        
-        # Up until now, we haven't compared lesser or greater.
-        # lambda to figure out what ordinals are neighbors of lesser and greater
-        ord_neighbors = lambda x: puzzle.neighbors(x, puzzle.ordinal_category)
-        
-        @@@ Fix this
-
-        for o in ordinals:
-            o_plus_delta = o + delta
-            o_minus_delta = o - delta
-            logger.info(f"++ {o=}, {o_plus_delta=}, {o_minus_delta}")
-            logger.debug(f"++ {min(ord_neighbors(self.lesser))=}")
-            logger.debug(f"++ {max(ord_neighbors(self.greater))=}")
-
-            if p not in ord_neighbors(self.lesser) and o_plus_delta in numeric:
-                logger.debug(f"+++ {p} not a neighbor of {self.lesser}, so {o_plus_delta} removed from {self.greater}")
-                puzzle.mark_false(self.greater, o_plus_delta)
-            if p not in ord_neighbors(self.greater) and o_minus_delta in numeric:
-                logger.debug(f"+++ {p} not a neighbor of {self.greater}, so {o_minus_delta} removed from {self.lesser}")
-                puzzle.mark_false(self.lesser, o_minus_delta)
-
-
-            if p < min(ord_neighbors(self.lesser)) + delta:
-                logger.info(f"++++ {p=} < {min(ord_neighbors(self.lesser)) + delta=}")
-                puzzle.mark_false(self.greater, p)
-            if p > max(ord_neighbors(self.greater)) - delta:
-                logger.info(f"++++ {p=} > {max(ord_neighbors(self.greater)) - delta=}")
-                puzzle.mark_false(self.lesser, p)
-            if delta > 0:
-                # if p - delta isn't in lesser, then p can't be in greater
-                if o_minus_delta in numeric and o_minus_delta not in ord_neighbors(self.lesser):
-                    logger.info(f"+++++ {o_minus_delta=} not in {self.lesser} - removing {p} from {self.greater}")
-                    puzzle.mark_false(self.greater, p)
-                # if p + delta isn't in greater, then p can't be in lesser
-                if o_plus_delta in numeric and o_plus_delta not in ord_neighbors(self.greater):
-                    logger.info(f"+++++ {o_plus_delta=} not in {self.greater} - removing {p} from {self.lesser}")
-                    puzzle.mark_false(self.lesser, p)
-
 class LogicPuzzle:
     def __init__(self, categories, ordinal_category):
         # Check that all categories have the same number of items:
@@ -106,123 +79,262 @@ class LogicPuzzle:
                    f"{ordinal_category} not a valid category. Valid categories are: {list(categories.keys())}"
 
         self._ordinal = ordinal_category
+        # The ordinal bounds are needed by every comparison rule, so only work them out once
+        self._ord_sorted = sorted(categories[ordinal_category])
+        self._ord_min = self._ord_sorted[0]
+        self._ord_max = self._ord_sorted[-1]
 
         self._items = categories
-        self._all_items = []
-        self._answers = {}  # This will duplicate a lot of info, but we can come up with a more efficient way later.
+        self._cat_keys = tuple(categories)
+        self._all_items = tuple(itertools.chain.from_iterable(categories.values()))
+        self._node_cat = {}  # Reverse lookup from an item to its category
+        self._items_set = {}
+        self._others_in_cat = {}  # The other items in each item's category
         for k, v in categories.items():
-            self._all_items += v
+            self._items_set[k] = frozenset(v)
 
-            cat_minus_k = set(categories.keys()).difference([k])
             for item in v:
-                self._answers[item] = {e : None for e in cat_minus_k}
-
-        # pprint.pprint(self._answers)
-
-        self._G = nx.Graph()
+                self._node_cat[item] = k
+                self._others_in_cat[item] = self._items_set[k] - {item}
+
+        # Every item gets an integer id. The graph is stored as one bitmask per item where bit 'j'
+        # is set if an edge still exists between that item and item 'j'. ANDing an item's mask with a
+        # category mask gives that item's remaining candidates (its domain) in the category.
+        self._id = {item : i for i, item in enumerate(self._all_items)}
+        # The category of each item, indexed by item id
+        self._cat_of = tuple(self._node_cat[item] for item in self._all_items)
+        # The position of each item's category in _cat_keys, indexed by item id
+        self._cat_index = {k : c for c, k in enumerate(self._cat_keys)}
+        self._cat_index_of = tuple(self._cat_index[k] for k in self._cat_of)
+        # The solved answers as one flat table: entry 'i * len(categories) + c' is the id of the item
+        # that item 'i' has been matched to in category 'c', or -1 while that's still unknown
+        self._answer_ids = [-1] * (len(self._all_items) * len(self._cat_keys))
+        # Items are numbered category by category, so each category is one contiguous block of bits
+        self._cat_mask = {}
+        offset = 0
         for k, v in categories.items():
-            self._G.add_nodes_from(v, category=k)
-        
-        # Add edges
-        lists = [v for v in categories.values()]
-        
-        # Add edges between nodes from different lists, but no edges within the same list
-        for i, list1 in enumerate(lists):
-            for j, list2 in enumerate(lists):
-                if i < j:  # To avoid edges within the same list and duplicating edges
-                    for node1, node2 in itertools.product(list1, list2):
-                        self._G.add_edge(node1, node2)
-
-        self._rules = []
+            self._cat_mask[k] = ((1 << len(v)) - 1) << offset
+            offset += len(v)
+
+        # Add edges between nodes from different categories, but no edges within the same category.
+        # Every item starts out connected to every item that isn't in its own category.
+        all_mask = (1 << len(self._all_items)) - 1
+        self._adj = [all_mask & ~self._cat_mask[k] for k in self._cat_of]
+        # Kept up to date by _remove_edges so edge_count doesn't have to walk every mask
+        self._edge_count = sum(m.bit_count() for m in self._adj) // 2
+        # The other items in each item's category
+        self._others = [self._cat_mask[k] & ~(1 << i) for i, k in enumerate(self._cat_of)]
+        # The (other category, other category mask) pairs that _reduce_graph checks for each item. This is
+        # fixed by the categories, so build it once instead of re-walking the category dicts every time.
+        # Items in the same category share the same list.
+        arcs = {k : [(ot, mask) for ot, mask in self._cat_mask.items() if ot != k] for k in self._cat_keys}
+        self._arcs = [arcs[k] for k in self._cat_of]
+        # Mask of items that have lost an edge since _reduce_graph last checked them. Every item
+        # starts out unchecked.
+        self._to_reduce = all_mask
+
+        # Cache of neighbors_by_type results, keyed by item id. Each entry is the item's _changed_at
+        # stamp when it was built and the result, so it's stale as soon as the item loses an edge.
+        self._nbt_cache = {}
+
+        self._rules = []  # (rule, watch ids) pairs
+        # A counter bumped on every edge removal, the value it had when each item last lost an edge,
+        # and the value it had when each rule last started. A rule only needs to run again if one of
+        # the items it watches has changed since then.
+        self._clock = 0
+        self._changed_at = [0] * len(self._all_items)
+        self._last_run = []
 
         # Create a new graph just for greater/less than clues. We'll use this to find connected components
-        self._C = nx.Graph()
+        # It's stored as a dictionary of item -> set of items it's been compared with
+        self._C = {}
         self._greater = {} # this dictionary will contain the bigger item as the key and the smaller as the value
         self._lesser = {} # this dictionary will contain the smaller item as the key and the larger as the value
 
     @property
     def edge_count(self):
-        return self._G.number_of_edges()
+        return self._edge_count
 
     @property
     def ordinal_category(self):
         return self._ordinal
 
+    def get_answer(self, item, category):
+        # The item matched to 'item' in 'category', or None if it hasn't been found yet
+        j = self._answer_ids[self._id[item] * len(self._cat_keys) + self._cat_index[category]]
+        return None if j < 0 else self._all_items[j]
+
+    @property
+    def _answers(self):
+        # A read-only snapshot of the answer table as item -> {other category : matched item or None}.
+        # It's rebuilt on every access; answers are only recorded through mark_true.
+        answers = {}
+        for i, item in enumerate(self._all_items):
+            answers[item] = types.MappingProxyType(
+                {k : self.get_answer(item, k) for k in self._cat_index if k != self._cat_of[i]})
+        return types.MappingProxyType(answers)
+
     def mark_false(self, node1, node2) -> bool:
-        assert node1 in self._all_items
-        assert node2 in self._all_items
-        try:
-            self._G.remove_edge(node1, node2)
-            print(f"Removed {node1}<->{node2}")
-            return True
-        except nx.NetworkXError:
+        # One dict lookup per item; the asserts only check what it returned
+        id1, id2 = self._id.get(node1), self._id.get(node2)
+        assert id1 is not None, f"{node1} is not an item in this puzzle"
+        assert id2 is not None, f"{node2} is not an item in this puzzle"
+        # Once the puzzle starts converging most calls are for edges that are already gone, so check
+        # for that with a single bit test before doing any other work.
+        if not (self._adj[id1] >> id2) & 1:
             return False
-
-    def add_rule(self, fxn):
-        self._rules.append(fxn)
+        self._remove_edges(id1, 1 << id2)
+        return True
+
+    def mark_false_many(self, node, others) -> int:
+        # Remove the edges between 'node' and every item in 'others' at once.
+        # Returns the number of edges that were actually removed.
+        i = self._id.get(node)
+        assert i is not None, f"{node} is not an item in this puzzle"
+        mask = 0
+        for o in others:
+            mask |= 1 << self._id[o]
+        return self._remove_edges(i, mask).bit_count()
+
+    def _remove_edges(self, i, mask):
+        # Remove every edge between item 'i' and the items in 'mask' in one go.
+        # Returns the mask of edges that were actually removed.
+        mask &= self._adj[i]
+        if not mask:
+            return 0
+        self._adj[i] &= ~mask
+        self._edge_count -= mask.bit_count()
+        self._to_reduce |= (1 << i) | mask
+        self._clock += 1
+        self._changed_at[i] = self._clock
+        bit = 1 << i
+        for j in _bits(mask):
+            self._adj[j] &= ~bit
+            self._changed_at[j] = self._clock
+        if logger.isEnabledFor(logging.DEBUG):
+            for j in _bits(mask):
+                logger.debug("Removed %s<->%s", self._all_items[i], self._all_items[j])
+        return mask
+
+    def add_rule(self, fxn, *args, watch_nodes=None):
+        # 'watch_nodes' are the items the rule reads. If given, the rule is only re-run after one of
+        # them has lost an edge. Rules without any watch nodes (None or empty) are run on every pass.
+        # The rule helpers below can also be added with their arguments, e.g.
+        # add_rule(either_or, obj, pair), in which case their watch nodes are taken from the arguments.
+        if args:
+            if watch_nodes is None and fxn in _RULE_WATCH:
+                watch_nodes = _RULE_WATCH[fxn](*args)
+            helper = fxn
+            fxn = lambda puzzle: helper(puzzle, *args)
+        if watch_nodes is None and isinstance(fxn, Comparison):
+            watch_nodes = (fxn.greater, fxn.lesser)
+        watch_ids = None
+        if watch_nodes:
+            watch_ids = tuple(self._id[node] for node in watch_nodes)
+        self._rules.append((fxn, watch_ids))
+        # Make sure the rule gets run at least once
+        self._last_run.append(-1)
 
         if isinstance(fxn, Comparison):
             self._greater[fxn.greater] = fxn.lesser
             self._lesser[fxn.lesser] = fxn.greater
-            self._C.add_edge(fxn.greater, fxn.lesser)
+            self._C.setdefault(fxn.greater, set()).add(fxn.lesser)
+            self._C.setdefault(fxn.lesser, set()).add(fxn.greater)
 
     def execute_rules(self):
         current_edge_count = 1e9
-        while current_edge_count > self.edge_count:
-            current_edge_count = self.edge_count
-            
-            print("--- Begin Rules ---")
-            print(f"--- Edges: {self.edge_count}")
-            for i, f in enumerate(self._rules):
-                print(f"+ Rule {i+1}")
+        edge_count = self.edge_count
+        while current_edge_count > edge_count:
+            current_edge_count = edge_count
+
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                logger.debug("--- Begin Rules ---")
+                logger.debug("--- Edges: %s", current_edge_count)
+            # Rules run in order, each one seeing the edges removed by the rules before it
+            # Skip rules whose watched items haven't changed since the rule last ran
+            changed_at = self._changed_at.__getitem__
+            last_runs = self._last_run
+            for i, (f, watch_ids) in enumerate(self._rules):
+                if watch_ids is not None:
+                    if max(map(changed_at, watch_ids)) <= last_runs[i]:
+                        continue
+                    last_runs[i] = self._clock
+                if debug:
+                    logger.debug("+ Rule %s", i + 1)
                 f(self)
 
-            print(f"---- Edges: {self.edge_count}")
-            print("---- End Rules ----")
+            if debug:
+                logger.debug("---- Edges: %s", self.edge_count)
+                logger.debug("---- End Rules ----")
             self._reduce_graph()
+            edge_count = self.edge_count
+            logger.info("Rules pass: %s -> %s edges", current_edge_count, edge_count)
 
-        print(f"\nEdges: {self.edge_count}")
+        logger.info("Edges: %s", current_edge_count)
 
     def _reduce_graph(self):
-        for t, vs in self._items.items():
-            for v in vs:
-                for ot in self._items.keys():
-                    if ot == t:
-                        continue
-                    # print(f"Checking {v} for {ot} edges")
-                    if self._has_one_edge(v, ot):
-                        n1 = v
-                        n2 = self.neighbors(v, ot)[0]
-                        print(f"{n1} has a single '{ot}' edge with {n2}")
-                        assert n1 in self._items[t]
-                        assert n2 in self._items[ot]
-                        self.mark_true(n1, n2)
-                        self._share_info(n1, n2)
-
-    def _category(self, node):
-        for category, values in self._items.items():
-            if node in values:
-                return category
+        # Worklist version of a sweep over every (item, category) pair: only the items that have lost
+        # an edge since they were last checked can have a new single edge, or need their info shared
+        # again with the items they've been matched to. Returns the number of edges removed.
+        # Each category is a contiguous block of bits, so one AND per (item, category) pair gives the
+        # whole row of that block and m & (m - 1) tells whether it's down to a single bit.
+        start_edge_count = self.edge_count
+        adj = self._adj
+        all_items = self._all_items
+        while self._to_reduce:
+            lsb = self._to_reduce & -self._to_reduce
+            self._to_reduce ^= lsb
+            i = lsb.bit_length() - 1
+            n1 = all_items[i]
+            for ot, mask in self._arcs[i]:
+                # The item's remaining edges to category 'ot'
+                m = adj[i] & mask
+                if not m:
+                    logger.error("%s has no '%s' edges: %s", n1, ot, self.neighbors_by_type(n1))
+                    assert m != 0
+                    # The puzzle is contradictory. Skip the arc even when asserts are stripped by -O
+                    continue
+                if not m & (m - 1):
+                    # 'm' only has bits from the 'ot' block, so 'j' is always an 'ot' item
+                    j = m.bit_length() - 1
+                    logger.debug("%s has a single '%s' edge with %s", n1, ot, all_items[j])
+                    self._mark_true_ids(i, j)
+                    self._share_info_ids(i, j)
+        return start_edge_count - self.edge_count
+
+    def has_edge(self, node1, node2) -> bool:
+        return bool((self._adj[self._id[node1]] >> self._id[node2]) & 1)
 
     def neighbors(self, node, category = None):
+        # The adjacency mask ANDed with a category mask is the set of neighbors in that category
+        mask = self._adj[self._id[node]]
         if category:
-            assert node not in self._items[category]
-            return [node for node in self._G.adj[node] if node in self._items[category]]
-        else:
-            return [node for node in self._G.neighbors(node)]
+            assert self._node_cat[node] != category
+            mask &= self._cat_mask[category]
+        return [self._all_items[i] for i in _bits(mask)]
 
     def neighbors_by_type(self, node):
-        this_category = self._category(node)
-        adj = {}  # A dictionary of adjacent nodes by type
-        for category in self._items.keys():
-            if category == this_category:
-                continue
-            adj[category] = self.neighbors(node, category)
+        # Results are cached per node and reused until an edge touching 'node' is removed, so they
+        # stay valid across rules that don't touch it. The result is shared between callers, so it's a
+        # read-only mapping of category -> tuple of neighbors.
+        i = self._id[node]
+        stamp = self._changed_at[i]
+        cached = self._nbt_cache.get(i)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        # A dictionary of adjacent nodes by type, filled in with a single pass over the set bits
+        adj = {category : [] for category, _ in self._arcs[i]}
+        for j in _bits(self._adj[i]):
+            adj[self._cat_of[j]].append(self._all_items[j])
+        adj = types.MappingProxyType({category : tuple(items) for category, items in adj.items()})
+        self._nbt_cache[i] = (stamp, adj)
         return adj
 
     def count_edges_per_type(self, node):
-        adj = self.neighbors_by_type(node)
-        return { k : len(v) for k,v in adj.items()}
+        i = self._id[node]
+        adj = self._adj[i]
+        return { k : (adj & mask).bit_count() for k, mask in self._arcs[i]}
 
     def add_comparative_relationship(self, lesser, greater):
         # This is a first-class citizen of the puzzle because we'll need to collect information
@@ -233,64 +345,56 @@ class LogicPuzzle:
         #  and a != b , b != c & a != c
         pass
 
-    def _has_one_edge(self, node, category):
-        # print(f"Checking edge count on {node} of type '{category}'")
-        count = self.count_edges_per_type(node)
-        # For debugging purposes - hopefully this is never hit
-        if count[category] == 0:
-            print(node, self.neighbors_by_type(node))
-        assert count[category] != 0
-        return count[category] == 1
-
     def _share_info(self, node1, node2):
-        print(f"Sharing info between {node1} & {node2}")
-        node1_type = self._category(node1)
-        node2_type = self._category(node2)
-        # for the categories that aren't this category, we want to get neighbors,
-        # find the symmetric difference, and eliminate those edges from each other
-        for t in self._items.keys():
-            if t == node1_type:
-                unique_v_of_t = set([node1]).symmetric_difference(self.neighbors(node2, t))
-            elif t == node2_type:
-                unique_v_of_t = set(self.neighbors(node1, t)).symmetric_difference([node2])
-            else:
-                unique_v_of_t = set(self.neighbors(node1, t)).symmetric_difference(self.neighbors(node2, t))
-            # print(f"unique '{t}' values: ", unique_v_of_t)
-            for v in unique_v_of_t:
-                if t != node1_type:
-                    self.mark_false(node1, v)
-                if t != node2_type:
-                    self.mark_false(node2, v)
+        self._share_info_ids(self._id[node1], self._id[node2])
+
+    def _share_info_ids(self, id1, id2):
+        # _share_info on item ids, for callers like _reduce_graph that already have them
+        logger.debug("Sharing info between %s & %s", self._all_items[id1], self._all_items[id2])
+        # node1 and node2 are the same entity, so any item adjacent to only one of them can't be
+        # adjacent to either. XOR-ing the two adjacency rows gives those items for every category at
+        # once. Counting each node as its own neighbor makes the XOR handle node1's and node2's own
+        # categories the same way as every other category. _remove_edges masks with the row it's
+        # given, so each side only loses the bits it actually has.
+        unique = (self._adj[id1] | (1 << id1)) ^ (self._adj[id2] | (1 << id2))
+        if not unique:
+            # Nothing to share, e.g. when the pair was already solved by an earlier sweep
+            return
+        # An item's own category is itself plus self._others
+        self._remove_edges(id1, unique & ~(self._others[id1] | (1 << id1)))
+        self._remove_edges(id2, unique & ~(self._others[id2] | (1 << id2)))
 
     def mark_true(self, node1, node2):
+        id1, id2 = self._id.get(node1), self._id.get(node2)
+        assert id1 is not None, f"{node1} is not an item in this puzzle"
+        assert id2 is not None, f"{node2} is not an item in this puzzle"
+        self._mark_true_ids(id1, id2)
+
+    def _mark_true_ids(self, id1, id2):
         # There's a guaranteed edge between node1 and node2
         # Eliminate all type(node1) edges that are not node1 from node2
         # Eliminate all type(node2) edges that are not node2 from node1
-        type1 = self._category(node1)
-        type2 = self._category(node2)
-        assert node1 in self._items[type1]
-        assert node2 in self._items[type2]
-        not_node1 = set(self._items[type1]).difference([node1])
-        # print(f"'{type1}' node: {node1}, not node: {not_node1}")
-        for n in not_node1:
-            self.mark_false(n, node2)
-        not_node2 = set(self._items[type2]).difference([node2])
-        # print(f"'{type2}' node: {node2}, not node: {not_node2}")
-        for n in not_node2:
-            self.mark_false(n, node1)
+        self._remove_edges(id2, self._others[id1])
+        self._remove_edges(id1, self._others[id2])
         # Fill in the answer info
-        self._answers[node1][type2] = node2
-        self._answers[node2][type1] = node1
+        n_cats = len(self._cat_keys)
+        self._answer_ids[id1 * n_cats + self._cat_index_of[id2]] = id2
+        self._answer_ids[id2 * n_cats + self._cat_index_of[id1]] = id1
 
 
 # A collection of logical blocks often found in a logic puzzle:
 def neither_nor(puzzle, obj, pair):
     p1, p2 = pair
-    puzzle.mark_false(obj, p1)
-    puzzle.mark_false(obj, p2)
+    puzzle.mark_false_many(obj, pair)
     puzzle.mark_false(p1, p2)
 
-def either_or(puzzle, obj, pair):
+def _either_or_deductions(puzzle, obj, pair):
+    assert len(pair) == 2
+    node_cat = puzzle._node_cat
+    p1, p2 = pair
+    return _either_or_core(puzzle, obj, node_cat[obj], p1, node_cat[p1], p2, node_cat[p2])
+
+def _either_or_core(puzzle, obj, obj_type, p1, p1_type, p2, p2_type):
     # Example:
     #   node1 == (node2 ^ node3)
     # If node1 only has the node2 edge, then it can't have the node3 edge
@@ -301,51 +405,56 @@ def either_or(puzzle, obj, pair):
     # If node3 has only one edge to type(node1) and not node1, then
     #   node2 belongs to node1. All other edges of type(node2) can be removed
 
-    assert len(pair) == 2
-    obj_adj = puzzle.neighbors_by_type(obj)
-    obj_type = puzzle._category(obj)
-    p1, p2 = pair
-    p1_adj = puzzle.neighbors_by_type(p1)
-    p1_type = puzzle._category(p1)
-    p2_adj = puzzle.neighbors_by_type(p2)
-    p2_type = puzzle._category(p2)
-    puzzle.mark_false(p1, p2)
+    # Rather than changing the graph, this returns a list of (is_true, item1, item2) deductions
+    # which can be merged with the deductions of other rules before being applied.
+    # The categories of all three items are passed in, so callers like pairs that use the same items
+    # several times only look them up once.
+    deductions = []
+    deductions.append((False, p1, p2))
+    # Track what obj has been matched to so the same deduction isn't repeated
+    obj_is = set()
     
     # Check if p1 is a neighbor of obj. If not, then p2 belongs to obj.
     # Remove all edges that are not p2 of type(p2) from obj
-    if p1 not in obj_adj[p1_type]:
-        print(f"+ {p1} not in neighbors of {obj} -> {obj} belongs to {p2}")
-        puzzle.mark_true(obj, p2)
+    if not puzzle.has_edge(obj, p1):
+        logger.debug("+ %s not in neighbors of %s -> %s belongs to %s", p1, obj, obj, p2)
+        deductions.append((True, obj, p2))
+        obj_is.add(p2)
     # Check if p2 is a neighbor of obj. If not, then p1 belongs to obj.
     # Remove all edges that are not p1 of type(p1) from obj
-    if p2 not in obj_adj[p2_type]:
-        print(f"+ {p2} not in neighbors of {obj} -> {obj} belongs to {p1}")
-        puzzle.mark_true(obj, p1)
+    if not puzzle.has_edge(obj, p2):
+        logger.debug("+ %s not in neighbors of %s -> %s belongs to %s", p2, obj, obj, p1)
+        deductions.append((True, obj, p1))
+        obj_is.add(p1)
 
     if p1_type != p2_type:
+        # Only needed when the pair spans two categories
+        obj_adj = puzzle.neighbors_by_type(obj)
         # Check if obj has one edge of type(p1) and is p1
         obj_p1_type_neighbors = obj_adj[p1_type]
         if len(obj_p1_type_neighbors) == 1 and p1 in obj_p1_type_neighbors:
-            print(f"++ {obj} has 1 '{p1_type}' neighbor ({obj_p1_type_neighbors}) -> {obj} eliminated from {p2}")
-            puzzle.mark_false(obj, p2)
+            logger.debug("++ %s has 1 '%s' neighbor (%s) -> %s eliminated from %s", obj, p1_type, obj_p1_type_neighbors, obj, p2)
+            deductions.append((False, obj, p2))
         # Check if obj has one edge of type(p2) and is p2
         obj_p2_type_neighbors = obj_adj[p2_type]
         if len(obj_p2_type_neighbors) == 1 and p1 in obj_p2_type_neighbors:
-            print(f"++ {obj} has 1 '{p2_type}' neighbor ({obj_p2_type_neighbors}) -> {obj} eliminated from {p1}")
-            puzzle.mark_false(obj, p1)
+            logger.debug("++ %s has 1 '%s' neighbor (%s) -> %s eliminated from %s", obj, p2_type, obj_p2_type_neighbors, obj, p1)
+            deductions.append((False, obj, p1))
 
     # if p1 has one neighbor of type(obj) and not obj, then
     #   p2 belongs to obj
-    p1_neighbors = p1_adj[obj_type]
-    if len(p1_neighbors) == 1 and obj not in p1_neighbors:
-        print(f"+ {p1} has only one {obj_type} neighbor ({p1_neighbors}) -> {obj} belongs to {p2}")
-        puzzle.mark_true(obj, p2)
+    if p2 not in obj_is:
+        p1_neighbors = puzzle.neighbors_by_type(p1)[obj_type]
+        if len(p1_neighbors) == 1 and obj not in p1_neighbors:
+            logger.debug("+ %s has only one %s neighbor (%s) -> %s belongs to %s", p1, obj_type, p1_neighbors, obj, p2)
+            deductions.append((True, obj, p2))
     # if p2 has one neighbor of type(obj) and not obj, then
     #   p1 belongs to obj
-    p2_neighbors = p2_adj[obj_type]
-    if len(p2_neighbors) == 1 and obj not in p2_neighbors:
-        print(f"+ {p2} has only one {obj_type} neighbor ({p2_neighbors}) -> {obj} belongs to {p1}")
-        puzzle.mark_true(obj, p1)
+    if p1 not in obj_is:
+        p2_neighbors = puzzle.neighbors_by_type(p2)[obj_type]
+        if len(p2_neighbors) == 1 and obj not in p2_neighbors:
+            logger.debug("+ %s has only one %s neighbor (%s) -> %s belongs to %s", p2, obj_type, p2_neighbors, obj, p1)
+            deductions.append((True, obj, p1))
 
     # NOTE: A transitive relationship exists whenever you have a pre-existing true or false relationship
     # on the grid for either one of the two "either/or" options, in relation to the group of the
@@ -362,23 +471,24 @@ def either_or(puzzle, obj, pair):
         if len(typed_neighbors[other_category]) == 1:
             # Eliminate edges except for 'other_item' and 'typed_neighbors[other_category]' from the
             # obj neighbor list
-            items_to_eliminate = set(puzzle._items[other_category]).symmetric_difference([other_item, typed_neighbors[other_category][0]])
+            items_to_eliminate = puzzle._others_in_cat[other_item] - {typed_neighbors[other_category][0]}
             for ite in items_to_eliminate:
-                puzzle.mark_false(obj, ite)
+                deductions.append((False, obj, ite))
 
     # obj is either p1 or p2
     # If obj is p1, then we know that obj can't be any of the false conditions of p1 as it relates to category(p2)
     # If obj is p2, then we know that obj can't be any of the false conditions of p2 as it relates to category(p1)
     def transitive_false_propogation(pair_item, other_category):
-        print(f"in either_or({obj=}, {pair=})")
-        print(f"\ttransitive_false_propagation({pair_item=}, {other_category=})")
+        logger.debug("in either_or(obj=%r, pair=%r)", obj, (p1, p2))
+        logger.debug("\ttransitive_false_propagation(pair_item=%r, other_category=%r)", pair_item, other_category)
         # Get false conditions of pair_item in relation to other_category:
         typed_neighbors = puzzle.neighbors_by_type(pair_item)
-        print(f"neighbors of {pair_item} are: {typed_neighbors}")
-        not_items = set(puzzle._items[other_category]).symmetric_difference(typed_neighbors[other_category])
-        print(f"\t{obj} should not be {not_items}")
+        logger.debug("neighbors of %s are: %s", pair_item, typed_neighbors)
+        # The neighbors are a subset of the category, so this is just the items that aren't neighbors
+        not_items = puzzle._items_set[other_category].difference(typed_neighbors[other_category])
+        logger.debug("\t%s should not be %s", obj, not_items)
         for ni in not_items:
-            puzzle.mark_false(obj, ni)
+            deductions.append((False, obj, ni))
     
     # Only propogate relationships if the two items of the pair are in different categories 
     if p1_type != p2_type:
@@ -388,6 +498,20 @@ def either_or(puzzle, obj, pair):
         # transitive_false_propogation(p1, p2_type)
         # transitive_false_propogation(p2, p1_type)
 
+    return deductions
+
+def _apply_deductions(puzzle, deductions):
+    # Apply the true relationships first since they remove the most edges
+    for is_true, item1, item2 in deductions:
+        if is_true:
+            puzzle.mark_true(item1, item2)
+    for is_true, item1, item2 in deductions:
+        if not is_true:
+            puzzle.mark_false(item1, item2)
+
+def either_or(puzzle, obj, pair):
+    _apply_deductions(puzzle, _either_or_deductions(puzzle, obj, pair))
+
 def pairs(puzzle, pair1, pair2):
     assert len(pair1) == 2
     assert len(pair2) == 2
@@ -395,10 +519,14 @@ def pairs(puzzle, pair1, pair2):
     c, d = pair2
     puzzle.mark_false(a, b)
     puzzle.mark_false(c, d)
-    either_or(puzzle, a, pair2)
-    either_or(puzzle, b, pair2)
-    either_or(puzzle, c, pair1)
-    either_or(puzzle, d, pair1)
+    node_cat = puzzle._node_cat
+    a_type, b_type, c_type, d_type = node_cat[a], node_cat[b], node_cat[c], node_cat[d]
+    # Merge the either/or deductions of all four items (dropping duplicates) and apply them together
+    deductions = (_either_or_core(puzzle, a, a_type, c, c_type, d, d_type) +
+                  _either_or_core(puzzle, b, b_type, c, c_type, d, d_type) +
+                  _either_or_core(puzzle, c, c_type, a, a_type, b, b_type) +
+                  _either_or_core(puzzle, d, d_type, a, a_type, b, b_type))
+    _apply_deductions(puzzle, dict.fromkeys(deductions))
 
     def pair_same_type_logic(pair, p_type, other_pair):
         # If both items in one pair are the same type, then no other item from that type can
@@ -407,76 +535,126 @@ def pairs(puzzle, pair1, pair2):
         #   one is 'other_pair[0]` and the other is `other_pair[1]' 
         assert len(pair) == 2
         assert len(other_pair) == 2
-        others = set(pair).symmetric_difference(puzzle._items[p_type])
-        c, d = other_pair
-        for o in others:
+        others = puzzle._others_in_cat[pair[0]] - {pair[1]}
+        for o in other_pair:
+            if puzzle.mark_false_many(o, others):
+                logger.debug("++ %s & %s are both %s. None of %s can be %s", pair[0], pair[1], p_type, others, o)
 
-            o_adj = puzzle.neighbors(o)
-            # Guards are here only to avoid the spammy print statements
-            if o in puzzle.neighbors(c):
-                print(f"++ {pair[0]} & {pair[1]} are both {p_type}. {o} can't be {c}")
-                puzzle.mark_false(o, c)
-            if o in puzzle.neighbors(d):
-                print(f"++ {pair[0]} & {pair[1]} are both {p_type}. {o} can't be {d}")
-                puzzle.mark_false(o, d)
-
-    p1a_type = puzzle._category(a)
-    p1b_type = puzzle._category(b)
-    if p1a_type == p1b_type:
-        pair_same_type_logic(pair1, p1a_type, pair2)
-
-    p2c_type = puzzle._category(c)
-    p2d_type = puzzle._category(d)
-    if p2c_type == p2d_type:
-        pair_same_type_logic(pair2, p2c_type, pair1)
+    if a_type == b_type:
+        pair_same_type_logic(pair1, a_type, pair2)
+
+    if c_type == d_type:
+        pair_same_type_logic(pair2, c_type, pair1)
 
 def mutually_exclusive(puzzle, list_of_things):
     # All of the things in the list are different
-    # Add a false relationship to any intersections of the pairs of items in the list:
-    pairs = itertools.combinations(list_of_things, 2)
-    for p1, p2 in pairs:
-        puzzle.mark_false(p1, p2)
+    # Add a false relationship to any intersections of the pairs of items in the list.
+    # Each item only needs to be separated from the items after it to cover every pair.
+    things = list(list_of_things)
+    for i, thing in enumerate(things):
+        puzzle.mark_false_many(thing, things[i + 1:])
+
+def _delta_prune(numeric, numeric_set, lesser_nbrs, greater_nbrs, delta):
+    # The arithmetic at the core of delta_comparison, on plain values so it doesn't touch the puzzle.
+    # Given the values lesser and greater can still take, returns the sets of values that can be
+    # removed from lesser and from greater when greater == lesser + delta.
+    # The bitmask version costs time and memory in proportion to the range of the values, so it's only
+    # used when the values are packed closely enough
+    if (isinstance(delta, int) and all(isinstance(p, int) for p in numeric)
+            and max(numeric) - min(numeric) < 64 * len(numeric)):
+        return _delta_prune_bits(numeric, lesser_nbrs, greater_nbrs, delta)
+    min_lesser = min(lesser_nbrs)
+    max_greater = max(greater_nbrs)
+    logger.debug("++ min_lesser=%s, max_greater=%s", min_lesser, max_greater)
+    # greater can't be below min_greater, lesser can't be above max_lesser
+    min_greater = min_lesser + delta
+    max_lesser = max_greater - delta
+    not_lesser = set()
+    not_greater = set()
+    for p in numeric:
+        p_plus_delta = p + delta
+        p_minus_delta = p - delta
+        logger.debug("++ p=%s, p_plus_delta=%s, %s", p, p_plus_delta, p_minus_delta)
+
+        if p not in lesser_nbrs and p_plus_delta in numeric_set:
+            logger.debug("+++ %s not a value of lesser, so %s removed from greater", p, p_plus_delta)
+            not_greater.add(p_plus_delta)
+        if p not in greater_nbrs and p_minus_delta in numeric_set:
+            logger.debug("+++ %s not a value of greater, so %s removed from lesser", p, p_minus_delta)
+            not_lesser.add(p_minus_delta)
+
+        if p < min_greater:
+            logger.debug("++++ p=%s < min_lesser + delta=%s", p, min_greater)
+            not_greater.add(p)
+        if p > max_lesser:
+            logger.debug("++++ p=%s > max_greater - delta=%s", p, max_lesser)
+            not_lesser.add(p)
+        if delta > 0:
+            # if p - delta isn't in lesser, then p can't be in greater
+            if p_minus_delta in numeric_set and p_minus_delta not in lesser_nbrs:
+                logger.debug("+++++ p_minus_delta=%s not in lesser - removing %s from greater", p_minus_delta, p)
+                not_greater.add(p)
+            # if p + delta isn't in greater, then p can't be in lesser
+            if p_plus_delta in numeric_set and p_plus_delta not in greater_nbrs:
+                logger.debug("+++++ p_plus_delta=%s not in greater - removing %s from lesser", p_plus_delta, p)
+                not_lesser.add(p)
+    return not_lesser, not_greater
+
+def _delta_prune_bits(numeric, lesser_nbrs, greater_nbrs, delta):
+    # _delta_prune for integer values. Each group of values becomes a bitmask with bit 'p - base' set
+    # for every value 'p', so shifting a mask by 'delta' lines every p up with p + delta and all the
+    # values are checked at once instead of one at a time.
+    base = min(numeric)
+
+    def to_bits(values):
+        bits = 0
+        for p in values:
+            bits |= 1 << (p - base)
+        return bits
+
+    values = to_bits(numeric)
+    lesser_bits = to_bits(lesser_nbrs)
+    greater_bits = to_bits(greater_nbrs)
+    # If p isn't a value of lesser, p + delta can't be a value of greater
+    not_greater = ((values & ~lesser_bits) << delta) & values
+    # If p isn't a value of greater, p - delta can't be a value of lesser
+    not_lesser = ((values & ~greater_bits) >> delta) & values
+    # greater can't be below min(lesser) + delta, lesser can't be above max(greater) - delta
+    min_greater = min(lesser_nbrs) + delta - base
+    max_lesser = max(greater_nbrs) - delta - base
+    not_greater |= values & ((1 << max(min_greater, 0)) - 1)
+    not_lesser |= values & ~((1 << max(max_lesser + 1, 0)) - 1)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("++ lesser can't be %s, greater can't be %s",
+                     [p + base for p in _bits(not_lesser)], [p + base for p in _bits(not_greater)])
+    return ({p + base for p in _bits(not_lesser)}, {p + base for p in _bits(not_greater)})
 
 def delta_comparison(puzzle, lesser, greater, delta, category):
     assert delta >= 0
-    logger.info(f"\n\nSIZE_DELTA({lesser=}, {greater=}, {delta=})")
+    logger.debug("\n\nSIZE_DELTA(lesser=%r, greater=%r, delta=%r)", lesser, greater, delta)
     puzzle.mark_false(lesser, greater)
     numeric = puzzle._items[category]
-    cat_neighbors = lambda x: puzzle.neighbors(x, category)
     # lesser can't be the max size, greater can't be the min size
     puzzle.mark_false(greater, min(numeric))
     puzzle.mark_false(lesser, max(numeric))
-    for p in numeric:
-        p_plus_delta = p + delta
-        p_minus_delta = p - delta
-        logger.info(f"++ {p=}, {p_plus_delta=}, {p_minus_delta}")
-        logger.debug(f"++ {min(cat_neighbors(lesser))=}")
-        logger.debug(f"++ {max(cat_neighbors(greater))=}")
-
-        if p not in cat_neighbors(lesser) and p_plus_delta in numeric:
-            logger.debug(f"+++ {p} not a neighbor of {lesser}, so {p_plus_delta} removed from {greater}")
-            puzzle.mark_false(greater, p_plus_delta)
-        if p not in cat_neighbors(greater) and p_minus_delta in numeric:
-            logger.debug(f"+++ {p} not a neighbor of {greater}, so {p_minus_delta} removed from {lesser}")
-            puzzle.mark_false(lesser, p_minus_delta)
-
-
-        if p < min(cat_neighbors(lesser)) + delta:
-            logger.info(f"++++ {p=} < {min(cat_neighbors(lesser)) + delta=}")
-            puzzle.mark_false(greater, p)
-        if p > max(cat_neighbors(greater)) - delta:
-            logger.info(f"++++ {p=} > {max(cat_neighbors(greater)) - delta=}")
-            puzzle.mark_false(lesser, p)
-        if delta > 0:
-            # if p - delta isn't in lesser, then p can't be in greater
-            if p_minus_delta in numeric and p_minus_delta not in cat_neighbors(lesser):
-                logger.info(f"+++++ {p_minus_delta=} not in {lesser} - removing {p} from {greater}")
-                puzzle.mark_false(greater, p)
-            # if p + delta isn't in greater, then p can't be in lesser
-            if p_plus_delta in numeric and p_plus_delta not in cat_neighbors(greater):
-                logger.info(f"+++++ {p_plus_delta=} not in {greater} - removing {p} from {lesser}")
-                puzzle.mark_false(lesser, p)
-                
+
+    # Take one snapshot of the lesser/greater neighbors and evaluate every condition against it,
+    # collecting the values to remove. The edges are only removed once all values have been checked.
+    not_lesser, not_greater = _delta_prune(numeric, puzzle._items_set[category],
+                                           set(puzzle.neighbors(lesser, category)),
+                                           set(puzzle.neighbors(greater, category)), delta)
+    puzzle.mark_false_many(greater, not_greater)
+    puzzle.mark_false_many(lesser, not_lesser)
+
+# The items each rule helper reads, given the arguments it's added with (see LogicPuzzle.add_rule)
+_RULE_WATCH = {
+    neither_nor: lambda obj, pair: (obj, *pair),
+    either_or: lambda obj, pair: (obj, *pair),
+    pairs: lambda pair1, pair2: (*pair1, *pair2),
+    mutually_exclusive: lambda list_of_things: tuple(list_of_things),
+    delta_comparison: lambda lesser, greater, delta, category: (lesser, greater),
+}
+
 # Other solving methods that may or may not be covered:
 # Parallel cross elimination
 # Skewed cross elimination